@@ -1,17 +1,27 @@
+import concurrent.futures
 import csv
+import functools
 import logging
 import os
+import pickle
 import random
+import re
+import textwrap
 import time
 import requests
-import spacy
-import markovify
 
 from colour_constants import colour_constants as colour
 from io import BytesIO
 from PIL import Image, ImageFont, ImageDraw
 from typing import List
 
+# Shared session so repeated unsplash calls reuse the same
+# keep-alive connection instead of redoing TCP + TLS setup.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+)
+
 
 class Font:
     """Font class used to make structuring text properties
@@ -26,6 +36,10 @@ class Font:
     """The shadow/background colour of the text behind the main text."""
     font_size: int
     """The size of the text to be displayed on the image."""
+    colour_rgb: tuple
+    """The primary colour as an (r, g, b) tuple ready for Pillow."""
+    shadow_rgb: tuple
+    """The shadow colour as an (r, g, b) tuple ready for Pillow."""
 
     def __init__(
         self,
@@ -38,92 +52,194 @@ class Font:
         self.font_colour = font_colour
         self.font_shadow = font_shadow
         self.font_size = font_size
+        # Precomputed once so draw_text doesn't rebuild them per image
+        self.colour_rgb = (font_colour.red, font_colour.green, font_colour.blue)
+        self.shadow_rgb = (font_shadow.red, font_shadow.green, font_shadow.blue)
 
 
-def get_image(w: int, h: int, count: int = 0) -> bytes:
+def get_image(w: int, h: int) -> bytes:
     """Retrieves a rqandom image from unsplash to use as the background.
 
     Args:
         w (int): Width of the image
         h (int): Height of the image
-        count (int, optional): Used for recrsively calling this function if
-                               the first call to unsplash fails, doesn't need
-                               to be set when called.
 
     Returns:
         bytes: The byte data of the image.
     """
-    response = requests.get(f"https://source.unsplash.com/random/{w}x{h}")
-    logging.debug(response.headers)
-    if response.status_code != 200:
+    # retries unsplash 3 times before giving up
+    for attempt in range(4):
+        response = _SESSION.get(
+            f"https://source.unsplash.com/random/{w}x{h}", timeout=10
+        )
+        logging.debug(response.headers)
+        if response.status_code == 200:
+            return response.content
         logging.error(
-            f"Error getting image from Unisplash! Response: ({response.status_code})\nTrying again ({count})"
+            f"Error getting image from Unisplash! Response: ({response.status_code})\nTrying again ({attempt})"
         )
-        # retries unsplash 3 times before giving up
-        if count <= 3:
-            time.sleep(5)
-            get_image(w, h, count + 1)
-        else:
-            logging.error("Made > 3 attempts to get image from unsplash, aborting!")
-            quit()
-    return response.content
-
-
-def generate_model():
-    """Generates the Markovify model and saves to to JSON."""
-    nlp = spacy.load("en_core_web_sm")
-    logging.info("Loaded NLP")
+        # no point backing off after the final attempt
+        if attempt < 3:
+            time.sleep(2 ** attempt)
+    logging.error("Made > 3 attempts to get image from unsplash, aborting!")
+    quit()
+
+
+def generate_model(save_json: bool = False):
+    """Generates the Markovify model and saves it to 'model.pkl'.
+
+    Args:
+        save_json (bool, optional): True to also write the model to
+                                    'model.json' for debugging. Defaults to False.
+    """
+    # Only imported here so scripts that just render from an existing
+    # model.pkl don't pay for it at startup
+    import markovify
+
     with open("quotes.txt") as quotesfile:
-        quotes_doc = nlp(quotesfile.read()[0:1000000])
-    logging.info("Loaded quotes_doc")
-    quotes_sents = " ".join(
-        [sent.text for sent in quotes_doc.sents if len(sent.text) > 1]
-    )
-    logging.info("Loaded quotes_sents")
-    with open("model.json", "w") as jsonfile:
-        text_model = markovify.Text(quotes_sents, state_size=3)
-        jsonfile.write(text_model.to_json())
+        quotes_text = quotesfile.read(1000000)
+    logging.info("Loaded quotes_text")
+    # Hand markovify pre-split sentences so it skips its own
+    # sentence-splitting and retokenization pass over the corpus
+    parsed_sentences = [
+        sentence.split()
+        for sentence in re.split(r"(?<=[.!?])\s+", quotes_text)
+        if len(sentence) > 1
+    ]
+    text_model = markovify.Text(None, state_size=3, parsed_sentences=parsed_sentences)
+    # JSON has to be written before compiling, markovify can't
+    # serialize a compiled chain to JSON.
+    if save_json:
+        with open("model.json", "w") as jsonfile:
+            jsonfile.write(text_model.to_json())
+    text_model.compile(inplace=True)
+    with open("model.pkl", "wb") as picklefile:
+        pickle.dump(text_model, picklefile, protocol=5)
     return None
 
 
-def get_ai_quote(max_chars: int = 100) -> str:
-    """Generates a random quote from the Markov model saved in
+@functools.lru_cache(maxsize=1)
+def _load_model() -> "markovify.Text":
+    """Loads the pickled Markovify model, caching it so the file
+    is only read once per process.
 
-    Args:
-        max_chars (int, optional): Max length of the sentence to be generated. Defaults to 100.
+    Unpickling imports markovify on its own, so there's no explicit
+    import to pay for here.
 
     Returns:
-        str: The generated sentence.
+        markovify.Text: The deserialized (already compiled) model.
     """
     try:
-        with open("model.json", "r") as jsonfile:
-            quote_generator = markovify.Text.from_json(jsonfile.read())
+        with open("model.pkl", "rb") as picklefile:
+            quote_generator = pickle.load(picklefile)
             logging.info("Created Generator")
     except FileNotFoundError:
         logging.error(
-            "Could not find 'model.json' file. \
+            "Could not find 'model.pkl' file. \
             \nPlease call generate_model() before attempting to use generate_ai_quote()!"
         )
         quit()
+    return quote_generator
+
+
+def get_ai_quote(max_chars: int = 100) -> str:
+    """Generates a random quote from the Markov model saved in
 
-    return quote_generator.make_short_sentence(max_chars=100)
+    Args:
+        max_chars (int, optional): Max length of the sentence to be generated. Defaults to 100.
+
+    Returns:
+        str: The generated sentence.
+    """
+    return _load_model().make_short_sentence(max_chars=max_chars)
 
 
 def get_quote() -> str:
     """Returns an actual quote from 'quotes_all.csv'
 
+    Uses reservoir sampling to pick a uniformly random row in one
+    streaming pass, so the ~12 MB file never has to live in memory.
+
     Returns:
         [type]: [description]
     """
     try:
         with open("quotes_all.csv", "r") as quotes_csv:
-            quotes = list(csv.reader(quotes_csv, delimiter=";"))[2:]
+            reader = csv.reader(quotes_csv, delimiter=";")
+            # Skip the two header rows
+            next(reader)
+            next(reader)
+            chosen = None
+            for index, row in enumerate(reader):
+                if random.randrange(index + 1) == 0:
+                    chosen = row
+    except FileNotFoundError:
+        logging.error("Cannot find 'quotes_all.csv' file!\nExiting...")
+        quit()
+
+    return chosen
+
+
+@functools.lru_cache(maxsize=1)
+def _count_quotes() -> int:
+    """Counts the quote rows in 'quotes_all.csv' once per process.
+
+    Counts parsed CSV rows rather than raw lines so the total matches
+    what the sampling pass in get_quotes() enumerates, even if a quoted
+    field ever contains an embedded newline.
+
+    Returns:
+        int: The number of rows, minus the two header rows.
+    """
+    try:
+        with open("quotes_all.csv", "r") as quotes_csv:
+            reader = csv.reader(quotes_csv, delimiter=";")
+            # Skip the two header rows
+            next(reader)
+            next(reader)
+            return sum(1 for _ in reader)
     except FileNotFoundError:
         logging.error("Cannot find 'quotes_all.csv' file!\nExiting...")
         quit()
 
-    index = random.randint(0, len(quotes))
-    return quotes[index]
+
+def get_quotes(count: int) -> List[List[str]]:
+    """Returns `count` random quotes from 'quotes_all.csv' for batch use.
+
+    Pre-draws every row index in one random.choices call and collects
+    the rows in a single streaming pass, instead of paying one full
+    file scan per quote like repeated get_quote() calls would.
+
+    Args:
+        count (int): How many quotes to return (sampled with replacement).
+
+    Returns:
+        List[List[str]]: The sampled quote rows.
+    """
+    indices = random.choices(range(_count_quotes()), k=count)
+    wanted = {}
+    for slot, index in enumerate(indices):
+        wanted.setdefault(index, []).append(slot)
+    chosen = [None] * count
+    try:
+        with open("quotes_all.csv", "r") as quotes_csv:
+            reader = csv.reader(quotes_csv, delimiter=";")
+            # Skip the two header rows
+            next(reader)
+            next(reader)
+            remaining = len(wanted)
+            for index, row in enumerate(reader):
+                if index in wanted:
+                    for slot in wanted[index]:
+                        chosen[slot] = row
+                    remaining -= 1
+                    if not remaining:
+                        break
+    except FileNotFoundError:
+        logging.error("Cannot find 'quotes_all.csv' file!\nExiting...")
+        quit()
+
+    return chosen
 
 
 def block_quote(quote: str, line_length: int) -> List[str]:
@@ -136,20 +252,57 @@ def block_quote(quote: str, line_length: int) -> List[str]:
     Returns:
         List[str]: Array of strings made from teh quote split every `x` characters
     """
-    word_list = quote.split(" ")
-    print(word_list)
-    lines = []
-    buffer = ""
-    for index, word in enumerate(word_list):
-        if (index + 1) == len(word_list):
-            buffer += f"{word}"
-            lines.append(buffer)
-        elif (len(buffer) + len(word)) < line_length:
-            buffer += f"{word} "
-        else:
-            lines.append(buffer)
-            buffer = f"{word} "
-    return lines
+    return textwrap.wrap(quote, width=line_length, break_long_words=False)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_font(font_file: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """Loads a TrueType font from the fonts folder, cached by file and
+    size so the TTF is only parsed once.
+
+    Args:
+        font_file (str): The name of the file with extension in the fonts folder.
+        font_size (int): The size of the text to be displayed.
+
+    Returns:
+        ImageFont.FreeTypeFont: The loaded font.
+    """
+    return ImageFont.truetype(f"fonts/{font_file}", font_size)
+
+
+@functools.lru_cache(maxsize=64)
+def _author_tile(
+    author: str,
+    font_file: str,
+    font_size: int,
+    font_colour: tuple,
+    font_shadow: tuple,
+) -> Image.Image:
+    """Renders the author credit once into a transparent tile that can
+    be pasted onto every image crediting the same author.
+
+    Args:
+        author (str): The author name to render.
+        font_file (str): The name of the file with extension in the fonts folder.
+        font_size (int): The size of the text to be displayed.
+        font_colour (tuple): The primary colour as an (r, g, b) tuple.
+        font_shadow (tuple): The stroke colour as an (r, g, b) tuple.
+
+    Returns:
+        Image.Image: The rendered RGBA tile.
+    """
+    font = _load_font(font_file, font_size)
+    tile = Image.new("RGBA", (302, 82), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(tile)
+    draw.text(
+        (2, 2),
+        f"- {author}",
+        font_colour,
+        font=font,
+        stroke_width=2,
+        stroke_fill=font_shadow,
+    )
+    return tile
 
 
 def draw_text(
@@ -169,16 +322,8 @@ def draw_text(
     Returns:
         bytes: The image with the text drawn onto it in byte format.
     """
-    font_colour = (
-        font_data.font_colour.red,
-        font_data.font_colour.green,
-        font_data.font_colour.blue,
-    )
-    font_shadow = (
-        font_data.font_shadow.red,
-        font_data.font_shadow.green,
-        font_data.font_shadow.blue,
-    )
+    font_colour = font_data.colour_rgb
+    font_shadow = font_data.shadow_rgb
 
     # Parse the image bytes into a BytesIO object
     image_object = BytesIO(image_bytes)
@@ -187,27 +332,54 @@ def draw_text(
 
     # Try to load the font file
     try:
-        font = ImageFont.truetype(f"fonts/{font_data.font_file}", font_data.font_size)
+        font = _load_font(font_data.font_file, font_data.font_size)
     except OSError:
         logging.error(
             f"Cannot find font '{font_data.font_file}'! Did you put it in the 'fonts' directory?"
         )
         quit()
 
-    # Draw the main body of text line by line
-    for index, line in enumerate(image_text):
-        draw.text((50, 50 * (index + 1)), line, font_shadow, font=font)
-        draw.text((48, (50 * (index + 1)) - 2), line, font_colour, font=font)
+    # Draw the main body of text in a single pass, with a stroke
+    # standing in for the old shifted shadow layer
+    body = "\n".join(image_text)
+    draw.multiline_text(
+        (48, 48),
+        body,
+        font_colour,
+        font=font,
+        spacing=4,
+        stroke_width=2,
+        stroke_fill=font_shadow,
+    )
 
-    # Draw the author name in the bottom right corner
-    draw.text((600, 420), f"- {author}", font_shadow, font=font)
-    draw.text((598, 418), f"- {author}", font_colour, font=font)
+    # Paste the pre-rendered author credit in the bottom right corner
+    tile = _author_tile(
+        author, font_data.font_file, font_data.font_size, font_colour, font_shadow
+    )
+    image.paste(tile, (596, 416), tile)
 
     buf = BytesIO()
-    image.save(buf, format="JPEG")
+    # 4:2:0 subsampling at quality 85 without the optimize pass is the
+    # cheapest encode at comparable visual quality
+    image.save(buf, format="JPEG", quality=85, subsampling=2, optimize=False)
     return buf.getvalue()
 
 
+@functools.lru_cache(maxsize=1)
+def _authors() -> List[str]:
+    """Loads and filters 'authors.txt' once per process.
+
+    Only keeps authors where the name is less than 12 characters
+    because I haven't bothered trying to implement dynamic placing
+    of the author's name on the image yet.
+
+    Returns:
+        List[str]: The filtered author names.
+    """
+    with open("authors.txt") as authors_file:
+        return [a for a in authors_file.read().split("\n") if len(a) < 12]
+
+
 def create_quote_image(
     font_file: str,
     font_colour: colour.RGB,
@@ -233,16 +405,11 @@ def create_quote_image(
     split_quote = block_quote(quote, 35)
     font = Font(font_file, font_colour, font_shadow, font_size)
     if show_author:
-        with open("authors.txt") as authors:
-            # Only get authors where the name is less than 12 characters
-            # because I haven't bothered trying to implement dynamic
-            # placing of the author's name on the image yet.
-            authors = [a for a in authors.read().split("\n") if len(a) < 12]
         image = draw_text(
             image_bytes,
             font,
             split_quote,
-            author=authors[random.randint(0, len(authors) - 1)],
+            author=random.choice(_authors()),
         )
     else:
         image = draw_text(image_bytes, font, split_quote)
@@ -250,13 +417,53 @@ def create_quote_image(
     return image
 
 
+def create_quote_image_batch(
+    count: int,
+    font_file: str,
+    font_colour: colour.RGB,
+    font_shadow: colour.RGB,
+    font_size: int,
+    show_author: bool = False,
+) -> List[bytes]:
+    """Creates several quote images at once, overlapping the unsplash
+    fetches with quote generation and rendering via a thread pool.
+
+    Args:
+        count (int): How many images to create.
+        font_file (str): See `Font` class
+        font_colour (colour.RGB): See `Font` class
+        font_shadow (colour.RGB): See `Font` class
+        font_size (int): See `Font` class
+        show_author (bool, optional): True to show an author or false to default to Michael Scott. Defaults to False.
+
+    Returns:
+        List[bytes]: The image bytes for each generated image.
+    """
+    font = Font(font_file, font_colour, font_shadow, font_size)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        fetches = [pool.submit(get_image, 900, 500) for _ in range(count)]
+        # Generate the quotes on the main thread while the fetches are
+        # in flight, then hand the rendering off to the pool as well.
+        split_quotes = [block_quote(get_ai_quote(), 35) for _ in range(count)]
+        renders = []
+        for fetch, split_quote in zip(fetches, split_quotes):
+            if show_author:
+                author = random.choice(_authors())
+            else:
+                author = "Michael Scott"
+            renders.append(
+                pool.submit(draw_text, fetch.result(), font, split_quote, author)
+            )
+        return [render.result() for render in renders]
+
+
 if __name__ == "__main__":
     try:
-        with open("model.json") as _:
+        with open("model.pkl") as _:
             pass
     except FileNotFoundError:
         logging.warning(
-            "Could not find model.json, generating model now... (This might take a few minutes)"
+            "Could not find model.pkl, generating model now... (This might take a few minutes)"
         )
         generate_model()
     finally: